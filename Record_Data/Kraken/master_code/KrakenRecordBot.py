@@ -79,7 +79,10 @@ if __name__ == '__main__':
     local_settings = kr.Read_Local_Settings(sys.argv[1])
     
     #Initialise the Kraken
-    controller = kr.KrakenCall(market=local_settings["pair"])
+    controller = kr.KrakenCall(market=local_settings["pair"],
+                               stream_url=local_settings.get("stream_url"),
+                               stream_pair=local_settings.get("stream_pair"),
+                               settings=local_settings)
     
     #If we have the input params, run main. Otherwise exit
     try:
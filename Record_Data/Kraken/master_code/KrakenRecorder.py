@@ -31,6 +31,13 @@ from pykrakenapi import KrakenAPI
 import pandas as pd
 import json
 
+#Need to point the recorder to the TraderBot for the stream
+sys.path.append("../../../TraderBot/Kraken_Markets/master_code/")
+from KrakenStream import KrakenStreamFeed
+from KrakenHTTP import Make_API, Get_Pool
+from KrakenAssets import Get_Assets, Fetch_From
+from KrakenMarketBus import KrakenMarketBus, Publish_Feed
+
 #################################### Main program #######################
 def RecordBot(local_settings, controller):
     """ This function is the driver which sets up the StoreManager class,    
@@ -88,6 +95,14 @@ def RecordBot(local_settings, controller):
                 #Close the store
                 oneday_file_manager.store.close()
 
+            #The next streamed read starts from the last trade stored
+            if len(online_trades.index) > 0:
+                controller.last_stored = float(pd.to_numeric(online_trades["time"]).max())
+
+            #Say how the connections are reused every so often
+            if time.time() - controller.last_summary >= local_settings.get("http_summary", 600):
+                controller.last_summary = time.time()
+                print(controller.http.Summary_Line())
 
             #Close while loop
             #Sleep till next time
@@ -218,8 +233,13 @@ class StoreManager():
         print("Latest filetime : ", lft)
         
         
-        #Make the dataframe to append: 
-        self.new_online_trades = oneday_online_trades[oneday_online_trades.index > lft ]
+        #Make the dataframe to append. Trades in the same second as the
+        #last stored one may be new, so keep those not already in the file
+        stored = self.store.select(key=self.datatag, where="index >= lft")
+        later = oneday_online_trades[oneday_online_trades.index >= lft ]
+        stored_keys = set(Trade_Keys(stored))
+        is_new = [key not in stored_keys for key in Trade_Keys(later)]
+        self.new_online_trades = later[is_new]
         print ("new_online_trades : ", self.new_online_trades)
         
         self.num_new = len(self.new_online_trades.index)
@@ -281,13 +301,21 @@ class KrakenCall():
                     
         Args:                                                                                            
             -market (str)   : Which market to save the data for
+            -stream_url (str, optional) : The WebSocket url to stream trades from
+            -stream_pair (str, optional) : The WebSocket name of the market, eg., ETH/XBT
+            -settings (dictionary, optional) : The local settings, uses api_url, http_pool_size,
+                                   http_prewarm (connections opened at the start, default 1),
+                                   assets_file and assets_ttl. With them stream_pair can be
+                                   left out, without them a stream_url needs it. With market_bus (and a stream_url) the streamed
+                                   book and trades are published for the traders of this
+                                   machine, bus_depth levels deep (default 25)
 
         Returns:                                                                                         
             -KrakenCall() class
         """
 
 
-    def __init__(self,market=None):
+    def __init__(self,market=None,stream_url=None,stream_pair=None,settings=None):
 
         #Make sure the intialised values are set for the Connections
         if market==None:
@@ -298,17 +326,60 @@ class KrakenCall():
         #without storing keys
         #Try make a connection to the Kracken API
         try:
-            api = krakenex.API()
+            #Keep the connection open between reads and restarts
+            api = Make_API(settings=settings)
+            self.http = Get_Pool(settings)
             #Use the kraken wapper for better functionality
             self.client = KrakenAPI(api)
         except:
             print("Couldn't make a connection to the Kraken API")
             print("exit")
             sys.exit(1)
+
+        #Open the connection before the first read
+        if settings is not None and settings.get("http_prewarm", 1) > 0:
+            self.http.Warm(api.uri, settings.get("http_prewarm", 1))
+        
+        #Check Kraken has the market and find its WebSocket name to stream.
+        #The market keeps the name it was given as it names the archive
+        self.assets = None
+        if settings is not None:
+            self.assets = Get_Assets(lambda: Fetch_From(self.client), settings)
+        if self.assets is not None:
+            pair = self.assets.Pair(market)
+            if stream_url is not None and stream_pair is None:
+                stream_pair = self.assets.Ws_Name(pair)
+
+        #Without the WebSocket name the stream would subscribe to nothing
+        if stream_url is not None and stream_pair is None:
+            print("Need the WebSocket name of the pair to stream, eg., ETH/XBT")
+            print("Specify stream_pair keyword in settings file, or settings to look it up")
+            raise NameError("No stream_pair defined to stream " + str(market) + " from " + stream_url)
         
         #
         self.market = market
 
+        #Stream the trades instead of polling them
+        #The first read always uses the API to get the last 24hrs,
+        #and the streamed trades are made to look like what it gave
+        self.feed = None
+        self.bus = None
+        self.first_read = True
+        self.trade_layout = None
+        self.last_stored = None
+        self.last_summary = 0.0
+        if stream_url is not None:
+            print("Streaming " + str(stream_pair) + " trades from " + stream_url)
+            if settings is not None and "market_bus" in settings.keys():
+                #Share what we stream with the traders instead of each asking Kraken
+                depth = settings.get("bus_depth", 25)
+                self.bus = KrakenMarketBus(settings["market_bus"], depth=depth, create=True)
+                self.feed = Publish_Feed(KrakenStreamFeed(stream_url, stream_pair, depth=depth), self.bus)
+                print("Publishing " + str(stream_pair) + " into the market bus " + settings["market_bus"])
+            else:
+                self.feed = KrakenStreamFeed(stream_url, stream_pair)
+            self.feed.Start()
+
 
 ##################################
 def Get_Current_trades(since,controller):
@@ -334,8 +405,15 @@ def Get_Current_trades(since,controller):
         since = None
         
     #Make most recent data on bottom
+    #Use the streamed trade tape if we have one
     ascending = True
-    public_trades = controller.client.get_recent_trades(controller.market,since,ascending)
+    if controller.feed is not None and controller.feed.Is_Live() and not controller.first_read:
+        public_trades = Stream_Trades(controller.feed, controller.last_stored, controller.trade_layout)
+    else:
+        public_trades = controller.client.get_recent_trades(controller.market,since,ascending)
+        controller.first_read = False
+        if len(public_trades[0].index) > 0:
+            controller.trade_layout = public_trades[0].dtypes
     
     #Put the info we need into variables
     current_trades = public_trades[0] #This is a dataframe
@@ -366,6 +444,63 @@ def Get_Current_trades(since,controller):
     return current_trades, unique_online_tdates, trade_ttimes
     
 
+#########################################
+def Stream_Trades(feed, since=None, layout=None):
+    """ The streamed trades from since on, in the same columns and
+        types as the API gives, so both can be stored in one file.
+        Kraken streams the price and volume as strings, as the API does.
+
+        Args:
+            -feed (KrakenStreamFeed) : The stream of the market
+            -since (float, optional) : The unixtime of the last trade stored. None for the whole tape
+            -layout (pandas series, optional) : The dtypes of the columns the API gave
+
+        Returns:
+            -public_trades (list) : [trades, last] where trades is a dataframe, oldest first
+        """
+
+    trades = [t for t in list(feed.tape) if since is None or float(t[2]) >= since]
+    frame = pd.DataFrame({"price"  : [t[0] for t in trades],
+                          "volume" : [t[1] for t in trades],
+                          "time"   : [float(t[2]) for t in trades],
+                          "buy_sell" : ["buy" if t[3] == "b" else "sell" for t in trades],
+                          "market_limit" : ["limit" if t[4] == "l" else "market" for t in trades],
+                          "misc" : [t[5] for t in trades]})
+
+    if layout is not None:
+        #The stream does not give the trade id
+        for col in layout.index:
+            if not col in frame.columns:
+                frame[col] = -1
+        frame = frame[list(layout.index)].astype(layout.to_dict())
+
+    frame.index = pd.to_datetime(frame["time"].astype(float), unit="s")
+    frame.index.name = "dtime"
+
+    last = int(float(trades[-1][2]) * 10**9) if len(trades) > 0 else None
+    return [frame, last]
+
+
+#########################################
+def Trade_Keys(trades):
+    """ A key for each trade made of its time, price and volume, and
+        how many trades before it in the frame had the same ones, so
+        two equal trades in the same second are both kept.
+
+        Args:
+            -trades (pandas dataframe) : Trades as the API gives them
+
+        Returns:
+            -keys (list) : A tuple for each trade
+        """
+
+    columns = pd.DataFrame({"time"   : pd.to_numeric(trades["time"]).to_numpy(),
+                            "price"  : pd.to_numeric(trades["price"]).to_numpy(),
+                            "volume" : pd.to_numeric(trades["volume"]).to_numpy()})
+    columns["repeat"] = columns.groupby(["time", "price", "volume"]).cumcount()
+    return list(columns.itertuples(index=False, name=None))
+
+
 #########################################
 def Read_Local_Settings(input_file):
     """ This function reads the input parameters from the json file 
@@ -18,6 +18,7 @@ from __future__ import division
 import sys
 import os
 import time
+import threading
 from collections import OrderedDict
 from itertools import cycle
 import traceback
@@ -26,6 +27,16 @@ import traceback
 import krakenex
 from pykrakenapi import KrakenAPI
 import Utils as utl
+from KrakenScheduler import KrakenKeyScheduler, Kraken_Call_Types
+from KrakenStream import KrakenStreamFeed
+from KrakenMarketBus import KrakenBusFeed
+from KrakenJournal import KrakenJournal
+from KrakenMetrics import KrakenMetrics
+from KrakenTrace import KrakenTracer
+from KrakenShared import Make_Clients
+from KrakenHTTP import Get_Pool
+from KrakenParams import KrakenParamRefresher
+from KrakenAssets import Get_Assets, Fetch_From, Kraken_Ref_XBT
 
 #Import the modules needed for data IO
 import pandas as pd
@@ -44,7 +55,10 @@ class KrakenCore():
                  key=[''],
                  secret=[''],
                  sftppassword='',
-                 settings=None):
+                 settings=None,
+                 clients=None,
+                 shared=None,
+                 params=None):
 
         """
         Constructor of the Kraken Core Class
@@ -62,6 +76,15 @@ class KrakenCore():
         -The password to the sftpserver
         settings : dict, optional
         - A dictionary of the settings to be used
+        clients : list, optional
+        - Clients with the pykrakenapi calls to use instead of
+          connecting to Kraken, eg., a backtest client
+        shared : KrakenShared, optional
+        - The keys, rate limits, balance, clock and streams shared
+          with the bots of other markets in this process
+        params : tuple, optional
+        - The (lean, l, d) of a checkpoint, used instead of waiting
+          for the FileBot. It is read again in the background
         Returns
         -------
         Class 
@@ -95,43 +118,90 @@ class KrakenCore():
         #Make the connections once for better practice
         #without storing keys
         #Try make all connection to the Kracken API
+        self.shared = shared
         try:
+            if shared is not None:
+                #The markets of one process use the same keys and rate limits
+                self.clients = shared.clients
+                self.scheduler = shared.scheduler
+                self.http = shared.http
+            else:
+                print("Using Keys from input")
+                print("*****MAKE SURE KEYS/SECRETS IN RIGHT ORDER")
+                #Loop over all keys/secrets
+                if clients is not None:
+                    print("Using the clients given instead of connecting to Kraken")
+                    self.clients = list(clients)
+                    self.http = None
+                else:
+                    self.clients = Make_Clients(key, secret, settings)
+                    self.http = Get_Pool(settings)
 
-            print("Using Keys from input")
-            print("*****MAKE SURE KEYS/SECRETS IN RIGHT ORDER")
-            #Loop over all keys/secrets
-            self.clients = []
-            for keyj, secretj in zip(key,secret):
-
-                #Make the connection
-                api_j = krakenex.API(key=keyj, secret=secretj)
-                #Use the kraken wapper for better functionality
-                self.clients.append( KrakenAPI(api_j) )
+                #Hand out the keys based on their rate limit counters
+                self.scheduler = KrakenKeyScheduler(self.clients, settings)
 
             #Make a way to cycle through the keys
-            self.client_cycler = cycle(self.clients)            
+            self.client_cycler = cycle(self.clients)
         except:
             traceback.print_exc()
             print("Couldn't make a connection to the Kraken API")
             print("exit")
             raise
         
+        #The key and round trip of the last call of each thread, for the journal
+        self.last_call = threading.local()
+
+        #Time the stages of the bot
+        self.metrics = KrakenMetrics(enabled=settings.get("metrics", True),
+                                     name="kraken" if shared is None else market)
+        if "metrics_port" in settings.keys():
+            self.metrics.Start_Server(settings["metrics_port"])
+
+        #Say how often the calls reused a connection and how close the keys
+        #are to their rate limits. The markets of one process share the pool
+        #and the keys, so they are reported once by their controller
+        if self.http is not None and shared is None:
+            self.metrics.Add_Gauges(self.http.Get_Gauges)
+        if shared is None:
+            self.metrics.Add_Gauges(self.scheduler.Get_Gauges)
+
+        #Keep a timeline of the last stages, written out on kill -USR1.
+        #The markets of one process are all written, each to its own file
+        if "trace_buffer" in settings.keys():
+            self.metrics.tracer = KrakenTracer(settings["trace_buffer"])
+            prefix = settings.get("trace_file", "PDNS-Trace")
+            if shared is not None:
+                prefix = prefix + "-" + market
+            self.metrics.tracer.Dump_On_Signal(prefix)
+
         #Setup FileBot if there is any
-        self.Setup_FileBot(settings, sftppassword)
+        self.refresher = None
+        self.params_version = 0
+        self.Setup_FileBot(settings, sftppassword, params)
+
+        #The names, tick sizes and decimals of the markets from Kraken
+        self.assets = Get_Assets(lambda: Fetch_From(self.clients[0]), settings)
 
         #Save for later
         self.market = market
-        self.min_price = settings["min_increment"] #This is not bp
         self.bp = 0.0001 #This is bp
         self.acct_mrkt1 = self.Kraken_Lookup_Acct_Market(settings["Ex_Market1"])
         self.acct_mrkt2 = self.Kraken_Lookup_Acct_Market(settings["Ex_Market2"])
 
-        #Find the number of significant digits so we can round 
-        #the price later
-        digits = format(self.min_price, ".16f")
-        #Seperate based on dot
-        digits = digits.partition(".")[2]
-        self.min_price_digit = len(digits) - len(digits.lstrip("0")) + 1
+        if self.assets is not None:
+            self.market = self.assets.Pair_Of(settings["Ex_Market1"], settings["Ex_Market2"])
+            self.min_price = self.assets.Tick_Size(self.market) #This is not bp
+            self.min_price_digit = self.assets.Price_Decimals(self.market)
+        else:
+            print("Using min_increment from the settings file")
+            self.min_price = settings["min_increment"] #This is not bp
+
+            #Find the number of significant digits so we can round 
+            #the price later
+            digits = format(self.min_price, ".16f")
+            #Seperate based on dot
+            digits = digits.partition(".")[2]
+            self.min_price_digit = len(digits) - len(digits.lstrip("0")) + 1
 
         #Setup stuff        
         if "dust" in settings.keys():
@@ -142,10 +212,118 @@ class KrakenCore():
 
         if "odepth" in settings.keys():
             self.odepth = settings["odepth"]
+
+        #The last post of each side and level: (price, volume, expiry in local time)
+        self.quotes = {}
+
+        #Journal every order event to binary files
+        self.journal = None
+        if "journal_dir" in settings.keys():
+            self.journal = KrakenJournal(settings["journal_dir"], self.market,
+                                         flush=settings.get("journal_flush", 0.2),
+                                         resolve=lambda txids: self.Call_API("query_orders_info", txid=",".join(txids)),
+                                         resolve_interval=settings.get("journal_resolve", 10.0))
+
+        #Stream the book over the WebSocket API instead of polling it,
+        #or read it from the recorder on this machine
+        self.feed = None
+        if "market_bus" in settings.keys():
+            self.feed = KrakenBusFeed(settings["market_bus"])
+        elif "stream_url" in settings.keys():
+            self.Setup_Stream(settings)
         #
 
     ##########################################
-    def Setup_Volume_Stacking(self, settings, kraken_api=None):
+    def Setup_Stream(self, settings):
+        """
+        Start streaming the orderbook and trades of the market
+        
+        Parameters
+        ----------
+        settings : dict
+        - Uses stream_url, stream_pair (the WebSocket pair name, eg., ETH/XBT)
+          and optionally stream_depth
+        
+        Returns
+        -------
+        Puts the feed into self
+        """
+        #Kraken gives the WebSocket name of the pair
+        if "stream_pair" in settings.keys():
+            pair = settings["stream_pair"]
+        elif self.assets is not None:
+            pair = self.assets.Ws_Name(self.market)
+        else:
+            print("Need the WebSocket name of the pair to stream, eg., ETH/XBT")
+            print("Specify stream_pair keyword in settings file")
+            raise
+
+        depth = settings.get("stream_depth", 10)
+        if self.shared is not None:
+            self.feed = self.shared.Get_Feed(settings["stream_url"], pair, depth)
+            return
+
+        print("Streaming " + pair + " from " + settings["stream_url"])
+        self.feed = KrakenStreamFeed(settings["stream_url"],
+                                     pair,
+                                     depth=depth)
+        self.feed.Start()
+
+    ##########################################
+    def Call_API(self, method, *args, **kwargs):
+        """
+        Make a call to Kraken on the key with the most headroom
+        on its rate limit counter. If Kraken still says the key
+        is rate limited, the key is backed off and the call is
+        tried on the next best key.
+
+        Parameters
+        ----------
+        method : str
+        - The name of the pykrakenapi function to call
+        *args, **kwargs
+        - Passed onto the pykrakenapi function
+
+        Returns
+        -------
+        result
+        - Whatever the pykrakenapi function returns
+        """
+        #The balance and the clock are the same for every market of the account
+        if self.shared is not None:
+            if method == "get_server_time":
+                return self.shared.clock.Server_Time(self.Call_Keys)
+            if method == "get_account_balance":
+                return self.shared.balances.Get(self.Call_Keys, method)
+
+        return self.Call_Keys(method, *args, **kwargs)
+
+    ##########################################
+    def Call_Keys(self, method, *args, **kwargs):
+        """
+        Make a call to Kraken on the best key, see Call_API
+        """
+        call_type = Kraken_Call_Types.get(method, "info")
+
+        #A rejected call was never processed so it is safe to retry
+        for attempt in range(len(self.clients)):
+            index, client = self.scheduler.Acquire(call_type)
+            self.last_call.key = index
+            sent = time.perf_counter()
+            try:
+                with self.metrics.Stage("http:" + method, key=index):
+                    return getattr(client, method)(*args, **kwargs)
+            except Exception as e:
+                if not "EAPI:Rate limit exceeded" in str(e):
+                    raise
+                self.scheduler.Report_Rate_Limit(index)
+                if attempt == len(self.clients) - 1:
+                    raise
+            finally:
+                self.last_call.rtt = time.perf_counter() - sent
+
+    ##########################################
+    def Setup_Volume_Stacking(self, settings, kraken_api=None, d=None):
         """
         Sets up the Volume Stacking of prices
         
@@ -156,6 +334,9 @@ class KrakenCore():
         kraken_api : class, optional
         - A client to the kraken server to be used to convert
           the bitcoin volumes into different market volumes
+        d : float, optional
+        - The displacement to put all the volume at when there is
+          no stacking. Default the one read from the BotFile
         
         Returns
         -------
@@ -171,13 +352,13 @@ class KrakenCore():
             self.Dynamical_Stack = False
             print("No Volume Stacking parameter in settings file, defaulting to not using it. Using displacement form sftp.")
             #Put all volume in one place
-            Volume_Stack[str(self.d)] = self.tot_vol
+            Volume_Stack[str(self.d if d is None else d)] = self.tot_vol
 
         elif settings["VolumeStacking"]=="None":
             self.Dynamical_Stack = False
             #Put all volume in one place
             print("No volume stacking. Using displacement from sftp.")
-            Volume_Stack[str(self.d)] = self.tot_vol
+            Volume_Stack[str(self.d if d is None else d)] = self.tot_vol
 
             #TODO: elif == sftp then read from sftp server.  self.volume_stack_file = 'sftp'
         else:
@@ -255,7 +436,7 @@ class KrakenCore():
         return Volume_Stack
 
     ##########################################
-    def Setup_FileBot(self, settings, sftppass):
+    def Setup_FileBot(self, settings, sftppass, params=None):
         """
         Setup the connection to the filebot, either static or not.
 
@@ -265,6 +446,9 @@ class KrakenCore():
         - a dictionary of settings to use
         sftppass : str
         - password for the sftpserver
+        params : tuple, optional
+        - The (lean, l, d) of a checkpoint. The sftp server is then
+          connected to by the parameter refresher instead of now
         
         Returns
         -------
@@ -298,32 +482,19 @@ class KrakenCore():
         self.mrkt1 = settings["market1"]
         self.mrkt2 = settings["market2"]
 
+        #Restarting from a checkpoint, so quote with its values
+        if params is not None and not None in params:
+            self.lean, self.l, self.d = params
+            self.botfileclient = None
+            self.last_read_time = int(time.time())
+            print("Using the lean = " + str(self.lean) + " and L = " + str(self.l) + " of the checkpoint")
+            return
+
         if FileBot=="sftp":
             #Try make a connection to the Botfile
             try:
-                #If using the sftpserver check that we have the values needed for a connection
-                if not "sftphost" in settings.keys():
-                    print("Havent specified sftphost in settings file but want to connect")
-                    raise
-                if not "sftpusername" in settings.keys():
-                    print("Havent specified sftpusename in settings file but want to connect")
-                    raise
-
-                #Initialise Values
-                sftphost=settings["sftphost"]
-                sftpusername=settings["sftpusername"]
-                
-                #Do trivial check
-                if sftphost=="":
-                    raise ("No SFTP host defined. Add sftphost=xxx to the Controller initialization")
-                if sftpusername=="":
-                    raise ("No SFTP user name defined. Add sftpusername=xxx to the Controller initialization")
-                if sftppass=="":
-                    raise ("No SFTP password defined. Add sftppassword=xxx to the Controller initialization")
-
-                #Start the connection
-                print("Connecting to sftp server")
-                self.botfileclient = BotFile.BotFile(host=sftphost, username=sftpusername, password=sftppass)
+                #The connection is kept for the later reads
+                self.botfileclient = self.Connect_BotFile(settings, sftppass)
                 self.bfc = self.botfileclient.getBotFile2()["data"]
                 self.Set_Botfile_Params()
                 self.last_read_time = int(time.time())
@@ -342,9 +513,69 @@ class KrakenCore():
             self.Set_Botfile_Params()
             self.last_read_time = int(time.time())
 
+    #############################
+    def Connect_BotFile(self, settings, sftppass):
+        """
+        Connect to the BotFile on the sftp server
 
+        Parameters
+        ----------
+        settings : dict
+        - Uses sftphost and sftpusername
+        sftppass : str
+        - password for the sftpserver
+
+        Returns
+        -------
+        botfileclient : BotFile.BotFile
+        """
+        #If using the sftpserver check that we have the values needed for a connection
+        if not "sftphost" in settings.keys():
+            print("Havent specified sftphost in settings file but want to connect")
+            raise
+        if not "sftpusername" in settings.keys():
+            print("Havent specified sftpusename in settings file but want to connect")
+            raise
+
+        #Initialise Values
+        sftphost=settings["sftphost"]
+        sftpusername=settings["sftpusername"]
+
+        #Do trivial check
+        if sftphost=="":
+            raise ("No SFTP host defined. Add sftphost=xxx to the Controller initialization")
+        if sftpusername=="":
+            raise ("No SFTP user name defined. Add sftpusername=xxx to the Controller initialization")
+        if sftppass=="":
+            raise ("No SFTP password defined. Add sftppassword=xxx to the Controller initialization")
+
+        #Start the connection
+        print("Connecting to sftp server")
+        return BotFile.BotFile(host=sftphost, username=sftpusername, password=sftppass)
+
+    #############################
+    def Start_Param_Refresh(self, settings, sftppass, Volume_Stack):
+        """
+        Read the parameters and the volume stacking on a background thread
+        from now on, so that Reload_Params never waits for them
+
+        Parameters
+        ----------
+        settings : dict
+        - Dictionary of the options, uses reload_time
+        sftppass : str
+        - The password for the sftpserver
+        Volume_Stack : dictionary
+        - The volume stacking in use now
+
+        Returns
+        -------
+        refresher : KrakenParamRefresher
+        """
+        self.refresher = KrakenParamRefresher(self, settings, sftppass, Volume_Stack, settings["reload_time"])
+        self.refresher.Start()
+        return self.refresher
 
-                
     #############################
     def Reload_Params(self,reload_time, Volume_Stack, settings, sftppass):
         """
@@ -362,29 +593,27 @@ class KrakenCore():
         - The password for the sftpserver
         Returns
         -------
-        reloads the new settings into self
-        TODO: Reload Volume Settings and return.         
+        Volume_Stack : dictionary
+        - The latest volume stacking. lean, l and d are put into self.
+          With Start_Param_Refresh this only picks up the latest
+          snapshot, otherwise it reads them here every reload_time
         """
-        _reload = int(time.time()) - self.last_read_time - reload_time
-        if _reload >0.0:
-            #Need old displacement if using the static. 
-            old_displacement = self.d
-        
-            self.Setup_FileBot(settings, sftppass)
-
-            #Need to change this to just call Setp_Volume_Stack instead
-    
-            #If there is a static volume stacking we need to update the
-            #displacment read from sftp
-            if not self.Dynamical_Stack:
-                Volume_Stack[str(self.d)] = self.Volume_Stack.pop(old_displacement)
-            #If dynamical volume_stacking then update the volume_stack
-            else:
-                Volume_Stack = Volume_Stack
-            #
-            self.last_read_time = int(time.time())
+        if self.refresher is None:
+            self.refresher = KrakenParamRefresher(self, settings, sftppass, Volume_Stack, reload_time)
+
+        #Without the background thread read in the loop when it is time
+        if not self.refresher.Is_Running():
+            _reload = int(time.time()) - self.last_read_time - reload_time
+            if _reload >0.0:
+                self.refresher.Refresh()
+                self.last_read_time = int(time.time())
 
-        return Volume_Stack
+        #Take all the values from one snapshot
+        snapshot = self.refresher.snapshot
+        if snapshot.version != self.params_version:
+            self.lean, self.l, self.d = snapshot.lean, snapshot.l, snapshot.d
+            self.params_version = snapshot.version
+        return snapshot.Volume_Stack
         
     #############################
     #Get the public trade data
@@ -408,9 +637,15 @@ class KrakenCore():
         if since == "None":
             since = None
 
+        #The trades of a live feed are oldest first like ascending
+        if self.feed is not None and self.feed.Is_Live():
+            public_trades = self.feed.Get_Recent_Trades()
+            public_trades[0] = public_trades[0].iloc[::-1]
+            return public_trades
+
         #Make most recent data on top
         ascending = False
-        public_trades = next(self.client_cycler).get_recent_trades(self.market,since,ascending)
+        public_trades = self.Call_API("get_recent_trades",self.market,since,ascending)
         return public_trades    
 
     #############################
@@ -427,17 +662,78 @@ class KrakenCore():
         Updates parameters into self
         """
         
-        mrkt1 = self.mrkt1
-        mrkt2 = self.mrkt2
         #Get the parameters from the BotFile        
-        self.lean = self.bfc[mrkt1]["lean"][mrkt2]
-        self.l = self.bfc[mrkt1]["l"][mrkt2]
-        self.d = self.bfc[mrkt2]["displacement"]
+        self.lean, self.l, self.d = self.Get_Botfile_Params(self.bfc)
 
         #Print them
         print("lean = " + str(self.lean))
         print("L = " + str(self.l))
 
+    #############################
+    def Get_Botfile_Params(self, bfc):
+        """
+        The parameters of this market in a botfile
+
+        Parameters
+        ----------
+        bfc : dict
+        - The data of the BotFile
+
+        Returns
+        -------
+        (lean, l, d) : tuple
+        """
+        mrkt1 = self.mrkt1
+        mrkt2 = self.mrkt2
+        return bfc[mrkt1]["lean"][mrkt2], bfc[mrkt1]["l"][mrkt2], bfc[mrkt2]["displacement"]
+
+
+    #############################
+    def Apply_Bid_Lean2_Price(self,lean,l,d,rpm,balance_ratio,settings):
+
+        """
+        Applies the displacement and leans to the reference price (rpm).
+        The mirror of Apply_Ask_Lean2_Price about rpm: the ask is raised by
+        l when the lean is positive or zero, the bid is lowered by l when
+        the lean is negative, and each side moves away from rpm by d and
+        its own local lean
+        
+        Parameters
+        ----------
+        lean : float
+        - the lean to use to decide what formulas to use
+        l : float
+        - the numerical value to alter the rpm in terms of basis points (percentage)
+        d : float
+        - the displacement to alter the rpm in terms of basis points (percentage)
+        rpm : float
+        - the numerical value of the reference price which we will alter
+        balance_ratio : float
+        - Our balance ratio in units of the second market
+        settings: dict
+        - A dictionary of all settings
+        Returns
+        -------
+        bid_price : float
+        - The bid_price we should post at
+        """
+        
+        #Compute the Bid Local lean
+        local_lean = self.Get_Bid_Local_Lean(balance_ratio,settings)
+        
+        #Skew the prices based on Formulas
+        if lean >=0.0:
+            print("Lean Positive or Zero")
+            bid_price = rpm * (1.0 - d - local_lean)
+        elif lean < 0.0:
+            print("Lean Negative")
+            bid_price = rpm * (1.0 - d - l - local_lean)
+        else:
+            print("Lean is not a number")
+            raise
+
+
+        return bid_price
 
     #############################
     def Apply_Ask_Lean2_Price(self,lean,l,d,rpm,balance_ratio,settings):
@@ -512,7 +808,7 @@ class KrakenCore():
         #When to start and expire the trades relative to server time
         #Kraken functionality broken. Need to do ourselves 
         #and if in <n> then it's absolute unixtime
-        server_time = next(self.client_cycler).get_server_time()[1]
+        server_time = self.Call_API("get_server_time")[1]
         starttm = server_time + starttmAdd
         expiretm= server_time + expiretmAdd*time_fac
 
@@ -540,7 +836,12 @@ class KrakenCore():
         orderbook : list
         - The orderbook where the [0] element is the asks and [1] is the bids
         """
-        orderbook = next(self.client_cycler).get_order_book(mrkt,depth)
+        #Use the streamed book if it is up to date and deep enough
+        if self.feed is not None and mrkt == self.market:
+            if depth <= self.feed.depth and self.feed.Is_Live():
+                return self.feed.Get_OrderBook(depth)
+
+        orderbook = self.Call_API("get_order_book",mrkt,depth)
         return orderbook
         
     #############################
@@ -561,8 +862,9 @@ class KrakenCore():
         best_bid : float
         - The best bid in the orderbook
         """
-        best_ask = float(orderbook[0]['price'].sort_values(ascending=True ).iloc[0])
-        best_bid = float(orderbook[1]['price'].sort_values(ascending=False).iloc[0])
+        #Only the ends of the book are needed, no need to sort it
+        best_ask = float(orderbook[0]['price'].min())
+        best_bid = float(orderbook[1]['price'].max())
 
         return best_ask, best_bid
         
@@ -645,10 +947,10 @@ class KrakenCore():
         ohlc_data : list
         - [0] element is the ohlc data in pandas dataframe format. [1] is the read time        
         """
-        server_time_ohlc = next(self.client_cycler).get_server_time()[1]
+        server_time_ohlc = self.Call_API("get_server_time")[1]
         #The number 60.0 is in there because Kraken define candlestick_size
         #in terms of minutes but server time in terms in seconds. 
-        ohlc_data = next(self.client_cycler).get_ohlc_data(self.market, candlestick_size, server_time_ohlc-60.0*candlestick_size*number_of_sticks )
+        ohlc_data = self.Call_API("get_ohlc_data", self.market, candlestick_size, server_time_ohlc-60.0*candlestick_size*number_of_sticks )
         return ohlc_data
 
 
@@ -680,8 +982,10 @@ class KrakenCore():
         bids = orderbook[1]
 
         #Need to make the orderbook numbers
+        #The streamed book is already numbers
         cols = ['price', 'volume']
-        bids[cols] = bids[cols].apply(pd.to_numeric, errors='coerce')
+        if not all(pd.api.types.is_numeric_dtype(bids[col]) for col in cols):
+            bids[cols] = bids[cols].apply(pd.to_numeric, errors='coerce')
 
         #tot_vol is str, dust is float. 
         return bids.loc[ bids["volume"] > float(dust)*float(volume) ]
@@ -715,8 +1019,10 @@ class KrakenCore():
         asks = orderbook[0]
 
         #Need to make the orderbook numbers
+        #The streamed book is already numbers
         cols = ['price', 'volume']
-        asks[cols] = asks[cols].apply(pd.to_numeric, errors='coerce')
+        if not all(pd.api.types.is_numeric_dtype(asks[col]) for col in cols):
+            asks[cols] = asks[cols].apply(pd.to_numeric, errors='coerce')
 
         return asks.loc[ asks["volume"] > float(dust)*float(volume) ]
 
@@ -794,23 +1100,9 @@ class KrakenCore():
           then the market is already in bitcoin units, in contrast to second. 
         """
         
-        #The tag for the xbt market and
-        #what position xbt is in
-        Kraken_Ref_XBT = {}
-        Kraken_Ref_XBT["DASH"] = ("DASHXBT",2)
-        Kraken_Ref_XBT["USD"]  = ("XXBTZUSD",1)
-        Kraken_Ref_XBT["EUR"]  = ("XXBTZEUR",1)
-        Kraken_Ref_XBT["ZUSD"] = ("XXBTZUSD",1)
-        Kraken_Ref_XBT["ZEUR"] = ("XXBTZEUR",1)
-        Kraken_Ref_XBT["EOS"]  = ("EOSXBT",2)
-        Kraken_Ref_XBT["ETH"]  = ("XETHXXBT",2)
-        Kraken_Ref_XBT["XETH"] = ("XETHXXBT",2)
-        Kraken_Ref_XBT["BCH"]  = ("BCHXBT",2)
-        Kraken_Ref_XBT["XETC"] = ("XETCXXBT",2)
-        Kraken_Ref_XBT["XLTC"] = ("XLTCXXBT",2)
-        Kraken_Ref_XBT["XXLM"] = ("XXLMXXBT",2)
-        Kraken_Ref_XBT["XXMR"] = ("XXMRXXBT",2)
-        Kraken_Ref_XBT["XZEC"] = ("XZECXXBT",2)
+        #Kraken knows the pair of every asset with xbt
+        if self.assets is not None:
+            return self.assets.XBT_Market(mrkt)
 
         if not mrkt in Kraken_Ref_XBT.keys():
             print("The market you are asking for isn't referenced in lookup table")
@@ -837,6 +1129,9 @@ class KrakenCore():
         - The account market name to be used in the get account balance API call
         """
 
+        if self.assets is not None:
+            return self.assets.Asset(mrkt)
+
         acct_mrkt = mrkt         
         if mrkt == "XBT":
             acct_mrkt = "XXBT"
@@ -972,7 +1267,7 @@ class KrakenCore():
         """
 
         #Get acct balance for checks
-        acct_balance = next(self.client_cycler).get_account_balance()
+        acct_balance = self.Call_API("get_account_balance")
         
         #Figure out account volume 
         mrkt1_vol = float(acct_balance["vol"].loc[self.acct_mrkt1])
@@ -987,7 +1282,7 @@ class KrakenCore():
 
 
     ####################################
-    def Check_No_Large_Price_Change(self,current_price, price_change, recordbook):
+    def Check_No_Large_Price_Change(self,current_price, price_change, recordbook, current_time=None):
         """
         This function records data over a day timeframe and checks if the current price
         lies outside the mean value of the recorded data up to the price_change precentage. 
@@ -998,33 +1293,27 @@ class KrakenCore():
         - The current price of the market
         price_change : float
         - The maximum allowed deviation from the mean market price
-        recordbook : pandas dataframe
+        recordbook : RollingPriceWindow
         - a record of all prices up to a day timeframe
+        current_time : int, optional
+        - The unixtime of the price. Defaults to now.
 
         Returns
         -------
-        recordbook : pandas dataframe
+        recordbook : RollingPriceWindow
         - The updated recordbook
         """
 
-
-        #unixtime of one day
-        oneday = 60*60*24
-
         #current time
-        current_time = int(time.time())
-
-        #Remove entries older than a day
-        recordbook = recordbook[recordbook["unixtime"] > (current_time - oneday) ]
+        if current_time is None:
+            current_time = int(time.time())
 
         #Compute the mean price of the recorded data
-        mean_price = recordbook["price"].mean()
+        #Entries older than a day are removed in constant time
+        mean_price = recordbook.Mean(current_time)
         
         #Add a price into the data
-        datum = pd.DataFrame({ "unixtime" : [current_time],
-                               "price" : [current_price]
-        })
-        recordbook = recordbook.append(datum)
+        recordbook.Add(current_price, current_time)
 
 
         #Check if current price is too large or too small
@@ -37,8 +37,22 @@ sys.path.append("../../../../FileBot/")
 import BotFile
 #from filename import class
 from KrakenMidSpread import KrakenMidSpread
+from KrakenJournal import Journal_Trades
+import KrakenArchive as ka
 import Utils as utl
 
+#Where the parsed csv files are kept, next to the csv files
+Cache_Dir = ".PDNS-Cache"
+
+#The times of the midspread files and of the Kraken trades export
+Price_Time_Format = "%Y-%m-%d %H:%M:%S"
+Kraken_Trades_Time_Format = "%Y-%m-%d %H:%M:%S.%f"
+
+#The columns of the Kraken trades export
+Kraken_Trades_Dtypes = {"ordertxid" : str, "pair" : str, "time" : str, "type" : str, "ordertype" : str,
+                        "price" : np.float64, "cost" : np.float64, "fee" : np.float64,
+                        "vol" : np.float64, "margin" : np.float64, "misc" : str, "ledgers" : str}
+
 #################################### Main program #######################
 def main():
     """Run the code to calculate profit vs loss and then plot it. 
@@ -50,16 +64,6 @@ def main():
      """
         
 
-    #Read in prices need to gauge profit
-    mrk1mrkt2_file = "PDNS-midspread_kraken_ethbtc.csv"
-    mrk1usd_file = "PDNS-midspread_kraken_ethusd.csv" 
-    mrk2usd_file = "PDNS-midspread_kraken_btcusd.csv"
-
-    #Put into a dataframe
-    m1m2_prices  = Read_Price_CSV(mrk1mrkt2_file)
-    m1usd_prices = Read_Price_CSV(mrk1usd_file)
-    m2usd_prices = Read_Price_CSV(mrk2usd_file)
-    
     #Get history from website: Doesn't work as need permission
     url = "https://www.kraken.com/u/history/export?a=dl&k=SVBG"
 
@@ -67,29 +71,54 @@ def main():
     #with filename as this try 
     filename="PDNS-trades.csv"
     
-    #Read in CSV history
-    trades = Read_In_Kraken_History_CSV(filename)
-
-    #Add in API trade history (only 50 most recent)
-    trades = Add_In_API_Trades(controller, trades)
+    #The trades worked out by the last run, if we keep them
+    store_file = local_settings.get("pnl_store")
+    stored = None
+    if store_file is not None:
+        stored = Read_PnL_Store(store_file)
+
+    #Use the fills the bot journaled if it keeps a journal
+    if "journal_dir" in local_settings.keys():
+        #Only the days since the last run
+        start = None
+        if stored is not None and len(stored.index) > 0:
+            start = time.strftime("%Y%m%d", time.gmtime(stored["unixtime"].max()))
+        trades = Journal_Trades(local_settings["journal_dir"], controller.market, start=start)
+    else:
+        #Read in CSV history
+        trades = Read_In_Kraken_History_CSV(filename)
+
+        #Add in API trade history (only 50 most recent)
+        trades = Add_In_API_Trades(controller, trades)
 
-    #Turn table into format we need 
-    trades = Clean_Up_Trades_Book(local_settings, trades)
-    
-    #Add in account balance
-    trades = Import_Acct_Balance(controller, trades, local_settings)    
-
-    #Fill up table with all info
-    trades = Fill_Table_With_Info(trades, m1m2_prices, m1usd_prices, m2usd_prices)
+    #Read in prices need to gauge profit
+    if "price_archive" in local_settings.keys():
+        #Made from the trades we recorded, only around the trades to work out
+        start, end = Trades_Time_Range(trades, stored)
+        mrk1, mrk2 = local_settings["Ex_Market1"], local_settings["Ex_Market2"]
+        usd = local_settings.get("usd_asset", "ZUSD")
+        m1m2_prices  = Read_Archive_Prices(local_settings, mrk1 + mrk2, start, end)
+        m1usd_prices = Read_Archive_Prices(local_settings, mrk1 + usd, start, end)
+        m2usd_prices = Read_Archive_Prices(local_settings, mrk2 + usd, start, end)
+    else:
+        mrk1mrkt2_file = "PDNS-midspread_kraken_ethbtc.csv"
+        mrk1usd_file = "PDNS-midspread_kraken_ethusd.csv" 
+        mrk2usd_file = "PDNS-midspread_kraken_btcusd.csv"
+
+        #Put into a dataframe
+        m1m2_prices  = Read_Price_CSV(mrk1mrkt2_file)
+        m1usd_prices = Read_Price_CSV(mrk1usd_file)
+        m2usd_prices = Read_Price_CSV(mrk2usd_file)
 
+    #Get Account balance so can backtrack to original balance
+    acct_balance = controller.Call_API("get_account_balance")
 
-    #############################################
-    #Make the data to plot from start holding time
-    org_mrk1bal = trades.tail(n=1)["Mrk1Balance"].iloc[0]
-    org_mrk2bal = trades.tail(n=1)["Mrk2Balance"].iloc[0]
+    #Work out the balances and prices of every trade
+    trades = Pair_PnL(local_settings, trades, acct_balance, m1m2_prices, m1usd_prices, m2usd_prices, stored)
 
-    trades["holding_balance"] = org_mrk1bal * trades["midspread_price"] + org_mrk2bal
-    trades["traded_balance"]  = trades["Mrk1Balance"] * trades["midspread_price"] + trades["Mrk2Balance"]
+    #Keep it for the next run
+    if store_file is not None:
+        Write_PnL_Store(store_file, trades)
 
     
     #Plot the price
@@ -315,76 +344,121 @@ def Find_Price_At_Time(prices, unixtime):
             -price (float) : the price of asset at time unixtime. 
      """
 
-    #First get time below and above time, ordered by decreasing time
-    row_above = prices.loc[ prices["unixtime"] > unixtime ].tail(n=1)
-    row_below = prices.loc[ prices["unixtime"] < unixtime ].head(n=1)
-
-    #If no above data try use lower
-    if row_above.empty:
-        if not row_below.empty:
-            #if the time is two hours old don't use
-            if row_below["unixtime"].iloc[0]   < (unixtime - 60*60*2):
-                return np.nan
-            else:
-                return row_below["price"].iloc[0]
-        else:
-            return np.nan
-
-    #If no below data try use upper
-    if row_below.empty:
-        if not row_above.empty:
-            #if the time is two hours new then don't use
-            if row_above["unixtime"].iloc[0]   > (unixtime + 60*60*2):
-                return np.nan
-            else:
-                return row_above["price"].iloc[0]
-        else:
-            return np.nan
+    return Find_Prices_At_Times(prices, np.array([unixtime]))[0]
 
 
-    #If the data is two hours old then don't use
-    if row_above["unixtime"].iloc[0] > (unixtime + 60*60*2):
-        if row_below["unixtime"].iloc[0]   < (unixtime - 60*60*2):
-            return np.nan
+#######################################
+def Sort_Prices(prices):
+    """The times and prices of a price history sorted by increasing time,
+       as Find_Prices_At_Times wants them. Sort once and pass these to look
+       up the same history many times, eg., from memory mapped files.
+
+        Args:
+            -prices (pandas dataframe) : contains price history, latest first
+        Returns:
+            -(times, values) (tuple) : numpy arrays of floats, oldest first
+     """
 
+    #Sort by increasing time. The prices are read in latest first, so
+    #reverse them first: of prices at the same time the one read in first
+    #is then the one before a time and the last the one after it, as in
+    #the lookup of one time at a time
+    times = prices["unixtime"].values.astype(float)[::-1]
+    order = np.argsort(times, kind="stable")
+    return times[order], prices["price"].values.astype(float)[::-1][order]
 
-            
-    #slope = (y2-y1)/(x2-x1)
-    slope = (row_above["price"].iloc[0] - row_below["price"].iloc[0]) / (row_above["unixtime"].iloc[0] - row_below["unixtime"].iloc[0])
 
-    #interpolated price from a line
-    price = slope * ( unixtime - row_below["unixtime"].iloc[0]) + row_below["price"].iloc[0]
-    
+#######################################
+def Find_Prices_At_Times(prices, unixtimes, stale=60*60*2):
+    """Find_Price_At_Time for many times at once. The prices are sorted
+       once and each time is placed between the prices just before and
+       just after it with a binary search, instead of scanning the whole
+       price table for every trade.
+                    
+        Args:                                                                                            
+            -prices (pandas dataframe or tuple) : contains price history, latest first,
+                                                  or the (times, values) of Sort_Prices
+            -unixtimes (numpy array) : the times at which to find the price
+            -stale (int, optional) : seconds after which a price is too old to use
+        Returns:                                                                                         
+            -price (numpy array) : the price of asset at each time, np.nan
+                                   if no prices within the two hour window
+     """
+
+    unixtimes = np.asarray(unixtimes, dtype=float)
+    if isinstance(prices, tuple):
+        times, values = prices
+    else:
+        times, values = Sort_Prices(prices)
+    if len(times) == 0:
+        return np.full(len(unixtimes), np.nan)
+
+    #The last price strictly before and the first strictly after each time
+    below = np.searchsorted(times, unixtimes, side="left") - 1
+    above = np.searchsorted(times, unixtimes, side="right")
+    has_below = below >= 0
+    has_above = above < len(times)
+    below = np.clip(below, 0, len(times) - 1)
+    above = np.clip(above, 0, len(times) - 1)
+
+    time_below, price_below = times[below], values[below]
+    time_above, price_above = times[above], values[above]
+
+    #If the data is two hours old then don't use
+    stale_below = time_below < (unixtimes - stale)
+    stale_above = time_above > (unixtimes + stale)
+
     #Take the price as it would line on a line between two points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (price_above - price_below) / (time_above - time_below)
+    price = slope * (unixtimes - time_below) + price_below
+
+    #If no above data use lower and if no below data use upper
+    price = np.where(has_below & ~has_above, price_below, price)
+    price = np.where(~has_below & has_above, price_above, price)
+
+    unusable = ((~has_below & ~has_above)
+                | (has_below & ~has_above & stale_below)
+                | (~has_below & has_above & stale_above)
+                | (has_below & has_above & stale_below & stale_above))
+    price[unusable] = np.nan
     return price
     
 
 ####################################################
-def Read_In_Kraken_History_CSV(name):
+def Read_In_Kraken_History_CSV(name, cache=True):
     """Get All trades from csv file in Kraken History tab and 
        put in a pandas dataframe. 
                     
         Args:                                                                                            
             -name (str) : filename of the file to read from. 
+            -cache (bool, optional) : read from and keep the parsed file in Cache_Dir
         Returns:                                                                                         
             -trades (pandas dataframe) : contains trades history
      """
 
+    #Parsing a large export is slow, so use the last parse if the file is the same
+    trades = Read_Cache(name) if cache else None
+
     #kraken get_trades_history only gives last 50 trades through their API.
     #But give all up to 2 days ago on their history
     #Try read in the file
-    try:
-        trades = pd.read_csv(name,header=0,index_col=0,keep_date_col=True,parse_dates=True,infer_datetime_format=True)
+    if trades is None:
+        try:
+            trades = pd.read_csv(name, header=0, index_col=0, dtype=Kraken_Trades_Dtypes)
+            trades["time"] = Parse_Times(trades["time"], Kraken_Trades_Time_Format)
 
-        #Arrange by time latest first
-        trades.sort_values(by=["time"], inplace=True, ascending=False)
+            #Arrange by time latest first
+            trades.sort_values(by=["time"], inplace=True, ascending=False, kind="mergesort")
 
-        #Rename price to traded price
-        trades.rename(columns={"price" : "traded_price"}, inplace=True)
-    except Exception:
-        traceback.print_exc()
-        print("Something went wrong with reading in csv file : ", filename)
+            #Rename price to traded price
+            trades.rename(columns={"price" : "traded_price"}, inplace=True)
 
+            if cache:
+                Write_Cache(name, trades)
+        except Exception:
+            traceback.print_exc()
+            print("Something went wrong with reading in csv file : ", name)
         
     #Find out number of trades done in this history file
     num_trades = len(trades.index)
@@ -392,39 +466,179 @@ def Read_In_Kraken_History_CSV(name):
     return trades
 
 ####################################################
-def Read_Price_CSV(name):
+def Read_Price_CSV(name, cache=True):
     """Get price from file and put into a pandas dataframe
                     
         Args:                                                                                            
             -name (str) : filename of the file to read from. 
+            -cache (bool, optional) : read from and keep the parsed file in Cache_Dir
         Returns:                                                                                         
             -prices (pandas dataframe) : contains price history
      """
 
+    #Use the last parse if the file is the same
+    prices = Read_Cache(name) if cache else None
+    if prices is not None:
+        return prices
+
     #Try read in the file
     try:
         #Read in the prices
         col_names = ["time", "price"]
-        prices = pd.read_csv(name, names=col_names, header=None, keep_date_col=True,parse_dates=True,infer_datetime_format=True)
+        prices = pd.read_csv(name, names=col_names, header=None, dtype={"time" : str, "price" : np.float64})
+        prices["time"] = Parse_Times(prices["time"], Price_Time_Format)
 
         #Arrange by time latest first
-        prices.sort_values(by=["time"], inplace=True, ascending=False)
+        prices.sort_values(by=["time"], inplace=True, ascending=False, kind="mergesort")
+        prices.reset_index(drop=True, inplace=True)
 
         #Convert time to unix time
-        to_unixtime= ["unixtime"]
-        prices["unixtime"]  = prices["time"]
-        prices[to_unixtime] = prices[to_unixtime].apply(pd.to_datetime)
-        prices[to_unixtime] = prices[to_unixtime].astype('int64') // 10**9
+        prices["unixtime"] = prices["time"].values.astype("datetime64[s]").astype(np.int64)
 
-        
     except Exception:
         traceback.print_exc()
-        print("Something went wrong with reading in csv file : ", filename)
+        print("Something went wrong with reading in csv file : ", name)
         raise
 
-    #
+    if cache:
+        Write_Cache(name, prices)
     return prices
 
+####################################################
+def Read_Archive_Prices(settings, pair, start=None, end=None):
+    """Get the prices of a pair from the trades the recorder keeps in
+       <price_archive>/PDNS-<pair>, instead of a midspread csv file
+                    
+        Args:                                                                                            
+            -settings (dictionary) : dictionary of settings. Uses price_archive, the
+                                     Record_Data/Kraken directory, price_bucket (seconds,
+                                     default 60) and price_method (last or vwap)
+            -pair (str) : the Kraken pair, eg., XETHZUSD
+            -start, end (datetime, optional) : the times to read the archive between
+        Returns:                                                                                         
+            -prices (pandas dataframe) : contains price history
+     """
+
+    archive_dir = os.path.join(settings["price_archive"], "PDNS-" + pair)
+    prices = ka.Archive_Price_Series(archive_dir, pair, start, end,
+                                     bucket=settings.get("price_bucket", 60),
+                                     method=settings.get("price_method", "last"))
+    print("This is number of prices of " + pair + " in the archive : ", len(prices.index))
+    return prices
+
+####################################################
+def Trades_Time_Range(trades, stored=None, stale=60*60*2):
+    """The times the prices are needed between to work out the trades,
+       which is the trades not in the store and two hours either side.
+       A trade may reach us after later ones were stored, so it is the
+       trades not in the store and not only those after it.
+                    
+        Args:                                                                                            
+            -trades (pandas dataframe) : contains trades history, as read in
+            -stored (pandas dataframe, optional) : the trades worked out by the last run
+            -stale (int, optional) : seconds a price is used for
+        Returns:                                                                                         
+            -(start, end) (tuple) : datetimes, None when there are no trades
+     """
+
+    if len(trades.index) == 0:
+        return None, None
+
+    times = pd.to_datetime(trades["time"])
+    start, end = times.min(), times.max()
+    if stored is not None and len(stored.index) > 0:
+        new = times.loc[~trades.index.isin(stored.index)]
+        #With nothing new only the prices around the latest trade are used
+        start, end = (new.min(), new.max()) if len(new.index) > 0 else (end, end)
+    return start - pd.Timedelta(seconds=stale), end + pd.Timedelta(seconds=stale)
+
+####################################################
+def Parse_Times(times, time_format):
+    """Parse a column of times with a fixed format, which is much faster
+       than working the format out for every row. Falls back to the slow
+       way if a time doesn't have the format.
+                    
+        Args:                                                                                            
+            -times (pandas series) : the times as strings
+            -time_format (str) : eg., %Y-%m-%d %H:%M:%S
+        Returns:                                                                                         
+            -times (pandas series) : the times as datetimes
+     """
+
+    try:
+        return pd.to_datetime(times, format=time_format)
+    except (ValueError, TypeError):
+        return pd.to_datetime(times)
+
+####################################################
+def Cache_File(name):
+    """The cache file of a csv file, in Cache_Dir next to it
+                    
+        Args:                                                                                            
+            -name (str) : filename of the csv file
+        Returns:                                                                                         
+            -cache_name (str) : filename of its cache
+     """
+
+    directory, filename = os.path.split(os.path.abspath(name))
+    return os.path.join(directory, Cache_Dir, filename + ".pkl")
+
+####################################################
+def Read_Cache(name):
+    """Read the parsed csv file from its cache, if the file hasn't
+       changed since. The path, size and modification time of the file
+       are kept with the parse and have to match.
+                    
+        Args:                                                                                            
+            -name (str) : filename of the csv file
+        Returns:                                                                                         
+            -frame (pandas dataframe) : as parsed before, None if there
+                                        is no cache or the file has changed
+     """
+
+    cache_name = Cache_File(name)
+    if not os.path.isfile(cache_name) or not os.path.isfile(name):
+        return None
+
+    try:
+        cached = pd.read_pickle(cache_name)
+        stat = os.stat(name)
+        if (cached["source"] != os.path.abspath(name) or cached["size"] != stat.st_size
+            or cached["mtime"] != stat.st_mtime_ns):
+            return None
+        return cached["frame"]
+    except Exception:
+        traceback.print_exc()
+        print("Something went wrong with reading in the cache : ", cache_name)
+        return None
+
+####################################################
+def Write_Cache(name, frame):
+    """Keep a parsed csv file for the next read, written whole or not at all.
+       A cache which can't be written never stops the read.
+                    
+        Args:                                                                                            
+            -name (str) : filename of the csv file
+            -frame (pandas dataframe) : the parsed file
+        Returns:                                                                                         
+            -Nothing returned.
+     """
+
+    cache_name = Cache_File(name)
+    try:
+        if not os.path.isdir(os.path.dirname(cache_name)):
+            os.makedirs(os.path.dirname(cache_name))
+        stat = os.stat(name)
+        cached = {"source" : os.path.abspath(name),
+                  "size"   : stat.st_size,
+                  "mtime"  : stat.st_mtime_ns,
+                  "frame"  : frame}
+        pd.to_pickle(cached, cache_name + ".tmp")
+        os.replace(cache_name + ".tmp", cache_name)
+    except Exception:
+        traceback.print_exc()
+        print("Couldn't write the cache : ", cache_name)
+
 ##########################################
 def Add_In_API_Trades(controller, trades):
     """Add in the recent API Trades into the trades dataframe
@@ -436,7 +650,21 @@ def Add_In_API_Trades(controller, trades):
      """
 
     #Get API Trades 
-    trades_api, cnt = next(controller.client_cycler).get_trades_history()
+    trades_api, cnt = controller.Call_API("get_trades_history")
+    return Merge_API_Trades(trades_api, trades)
+
+##########################################
+def Merge_API_Trades(trades_api, trades):
+    """Add the get_trades_history answer into the trades dataframe
+                    
+        Args:                                                                                            
+            -trades_api (pandas dataframe) : the get_trades_history answer
+            -trades (pandas dataframe) : contains trades history
+        Returns:                                                                                         
+            -trades (pandas dataframe) : contains trades history
+     """
+
+    trades_api = trades_api.copy()
 
     #Rename the columns to get in same format as the CVS file
     trades_api.rename(columns={"price" : "traded_price"}, inplace=True)
@@ -495,12 +723,9 @@ def Clean_Up_Trades_Book(settings, trades):
     to_float = ["vol", "traded_price", "Mrk1Balance", "Mrk2Balance"]
     trades[to_float] = trades[to_float].apply(pd.to_numeric, errors='coerce')
 
-    #Convert time to unix time
-    trades["time"] = trades["time"].apply(pd.to_datetime)
-    to_unixtime= ["unixtime"]
-    trades["unixtime"] = trades["time"]
-    trades[to_unixtime] = trades[to_unixtime].apply(pd.to_datetime)
-    trades[to_unixtime] = trades[to_unixtime].astype('int64') // 10**9
+    #Convert time to unix time, the times are mostly parsed already
+    trades["time"] = pd.to_datetime(trades["time"])
+    trades["unixtime"] = trades["time"].values.astype("datetime64[s]").astype(np.int64)
 
     return trades
 
@@ -518,7 +743,21 @@ def Import_Acct_Balance(controller, trades, settings):
      """
     
     #Get Account balance so can backtrack to original balance
-    acct_balance = next(controller.client_cycler).get_account_balance()
+    acct_balance = controller.Call_API("get_account_balance")
+    return Set_Acct_Balance(trades, acct_balance, settings)
+
+#######################
+def Set_Acct_Balance(trades, acct_balance, settings):
+    """Put the account balance into the latest trade of the tradebook
+                    
+        Args:                                                                                            
+            -trades (pandas dataframe) : contains trades history
+            -acct_balance (pandas dataframe) : the get_account_balance answer
+            -settings (dictionary) : dictionary of settings
+        Returns:                                                                                         
+            -trades (pandas dataframe) : contains trades history
+     """
+
     print("This is the acct balance : ")
     print(acct_balance)
 
@@ -543,49 +782,174 @@ def Fill_Table_With_Info(trades, mrk1mrk2_prices, mrk1usd_prices, mrk2usd_prices
             -trades (pandas dataframe) : contains trades history
      """
 
-    #Loop over the trades
-    for index in trades.index:
+    #Get the market prices of the various quantities at every trade at once
+    unixtimes = trades["unixtime"].values
+    mrk1mrk2_price = Find_Prices_At_Times(mrk1mrk2_prices, unixtimes)
+    trades["midspread_price"] = mrk1mrk2_price
+    trades["market_price"] = mrk1mrk2_price
+    trades["Mrk1USD"] = Find_Prices_At_Times(mrk1usd_prices, unixtimes)
+    trades["Mrk2USD"] = Find_Prices_At_Times(mrk2usd_prices, unixtimes)
 
-        #Get the row to fuck with
-        row = trades.loc[index]
-        #print(row)
-        
-        #This is the unixtime
-        unixtimei = row["unixtime"]
+    #And add account balance by backtracking. 
+    trades = Backtrack_Balances(trades)
 
-        #Get the market prices of the various quantities
-        mrk1mrk2_price = Find_Price_At_Time(mrk1mrk2_prices, unixtimei)
-        mrk1usd_price  = Find_Price_At_Time(mrk1usd_prices,  unixtimei)
-        mrk2usd_price  = Find_Price_At_Time(mrk2usd_prices,  unixtimei)
+    #
+    return trades
 
-        #Add values to dataframe
-        trades.at[index, "midspread_price"] = mrk1mrk2_price
-        trades.at[index, "market_price"] = mrk1mrk2_price
-        trades.at[index, "Mrk1USD"] = mrk1usd_price
-        trades.at[index, "Mrk2USD"] = mrk2usd_price
+#######################################
+def Backtrack_Balances(trades):
+    """Fill in the account balances before every trade, going back from
+       the balances of the latest trade (see Import_Acct_Balance). Each
+       trade changes the balances by its signed volume and notional, so the
+       balances are the latest ones plus the cumulative sum of the changes
+       of the later trades.
+                    
+        Args:                                                                                            
+            -trades (pandas dataframe) : contains trades history, latest first
+        Returns:                                                                                         
+            -trades (pandas dataframe) : with Mrk1Balance and Mrk2Balance in every row
+     """
 
-        
-        #And add account balance by backtracking. 
-        if trades["type"].loc[index] == "sell":
-            old_mrk1_vol = row["Mrk1Balance"] + row["vol"]
-            old_mrk2_vol = row["Mrk2Balance"] - row["traded_price"] * row["vol"]
-                
-        elif trades["type"].loc[index] == "buy":            
-            old_mrk1_vol = row["Mrk1Balance"] - row["vol"]
-            old_mrk2_vol = row["Mrk2Balance"] + row["traded_price"] * row["vol"]
-        
-        #Try put in the new balances into previous row
-        try:
-            iloc = trades.index.get_loc(index)
-            next_index = trades.index[iloc+1]
-            trades.at[next_index, "Mrk1Balance"] = old_mrk1_vol
-            trades.at[next_index, "Mrk2Balance"] = old_mrk2_vol
-            
-        except:
-            print("Have not updated the balances for this row number: ", iloc+1)
-            #raise
+    if len(trades.index) == 0:
+        return trades
 
-    #
+    #A sell had more of market 1 and less of market 2 before it
+    sign = np.where(trades["type"].values == "sell", 1.0,
+                    np.where(trades["type"].values == "buy", -1.0, 0.0))
+    vol = trades["vol"].values.astype(float)
+    mrk1_change = sign * vol
+    mrk2_change = -sign * trades["traded_price"].values.astype(float) * vol
+
+    #The balance of a row is the latest balance plus the changes of the rows before it
+    mrk1_balance = trades["Mrk1Balance"].values[0] + np.concatenate([[0.0], np.cumsum(mrk1_change)[:-1]])
+    mrk2_balance = trades["Mrk2Balance"].values[0] + np.concatenate([[0.0], np.cumsum(mrk2_change)[:-1]])
+    trades["Mrk1Balance"] = mrk1_balance
+    trades["Mrk2Balance"] = mrk2_balance
+
+    return trades
+
+#######################################
+def Pair_PnL(settings, trades, acct_balance, mrk1mrk2_prices, mrk1usd_prices, mrk2usd_prices, stored=None):
+    """Work out the balances, prices and value of every trade of one pair,
+       and what the balances it started with would be worth now.
+                    
+        Args:                                                                                            
+            -settings (dictionary) : dictionary of settings of the pair
+            -trades (pandas dataframe) : contains trades history, as read in
+            -acct_balance (pandas dataframe) : the get_account_balance answer
+            -mrk1mk2_prices (pandas dataframe) : The price of asset 1 in units of asset 2. 
+            -mrk1usd_prices (pandas dataframe) : The price of asset 1 in units of usd
+            -mrk2usd_prices (pandas dataframe) : The price of asset 2 in units of usd.
+                                                 Each may be the (times, values) of Sort_Prices
+            -stored (pandas dataframe, optional) : the trades worked out by the last run
+        Returns:                                                                                         
+            -trades (pandas dataframe) : contains trades history with holding_balance
+                                         and traded_balance in units of asset 2
+     """
+
+    #Turn table into format we need 
+    trades = Clean_Up_Trades_Book(settings, trades)
+
+    #Only work out the trades done since the last run
+    late = False
+    if stored is not None:
+        trades = New_Trades(trades, stored)
+        late = (len(trades.index) > 0 and len(stored.index) > 0
+                and trades["unixtime"].min() < stored["unixtime"].max())
+
+    if len(trades.index) > 0:
+        #Add in account balance
+        trades = Set_Acct_Balance(trades, acct_balance, settings)
+
+        #Fill up table with all info
+        trades = Fill_Table_With_Info(trades, mrk1mrk2_prices, mrk1usd_prices, mrk2usd_prices)
+
+    #Extend what was worked out before
+    if stored is not None:
+        trades = pd.concat([trades, stored])
+
+        #A trade older than stored ones changes the balances before it, so
+        #backtrack them all again from the latest trade, whose balance holds
+        if late:
+            trades = trades.sort_values(by="unixtime", ascending=False, kind="stable")
+            trades = Backtrack_Balances(trades)
+    if len(trades.index) == 0:
+        return trades
+
+    #############################################
+    #Make the data to plot from start holding time
+    org_mrk1bal = trades.tail(n=1)["Mrk1Balance"].iloc[0]
+    org_mrk2bal = trades.tail(n=1)["Mrk2Balance"].iloc[0]
+
+    trades["holding_balance"] = org_mrk1bal * trades["midspread_price"] + org_mrk2bal
+    trades["traded_balance"]  = trades["Mrk1Balance"] * trades["midspread_price"] + trades["Mrk2Balance"]
+
+    return trades
+
+#######################################
+def Read_PnL_Store(name):
+    """Read the trades worked out by the last run.
+                    
+        Args:                                                                                            
+            -name (str) : filename of the store
+        Returns:                                                                                         
+            -trades (pandas dataframe) : contains trades history with balances and
+                                         prices, None if there is no store
+     """
+
+    if not os.path.isfile(name):
+        print("No PnL store in : ", name)
+        return None
+
+    try:
+        trades = pd.read_pickle(name)
+    except Exception:
+        traceback.print_exc()
+        print("Something went wrong with reading in the PnL store : ", name)
+        return None
+
+    print("This is number of trades in the PnL store : ", len(trades.index))
+    return trades
+
+#######################################
+def Write_PnL_Store(name, trades):
+    """Keep the trades worked out for the next run, written whole or not at all.
+                    
+        Args:                                                                                            
+            -name (str) : filename of the store
+            -trades (pandas dataframe) : contains trades history with balances and prices
+        Returns:                                                                                         
+            -Nothing returned.
+     """
+
+    tmp_name = name + ".tmp"
+    trades.to_pickle(tmp_name)
+    os.replace(tmp_name, name)
+
+#######################################
+def New_Trades(trades, stored):
+    """The trades not in the store. Most are after the latest stored trade,
+       but a trade can reach us late, eg., the next CSV export after the
+       API trades were stored, or a fill stamped with when Kraken closed
+       the order, so a trade is new if its txid is not stored whatever
+       its time.
+                    
+        Args:                                                                                            
+            -trades (pandas dataframe) : contains trades history, cleaned up
+            -stored (pandas dataframe) : the trades of the store
+        Returns:                                                                                         
+            -trades (pandas dataframe) : only the new trades
+     """
+
+    if len(stored.index) == 0:
+        return trades
+
+    trades = trades.loc[~trades.index.isin(stored.index)]
+
+    print("This is number of new trades since the PnL store : ", len(trades.index))
+    late = int((trades["unixtime"] < stored["unixtime"].max()).sum())
+    if late > 0:
+        print("Of them older than the latest stored trade : ", late)
     return trades
 
 ##################################
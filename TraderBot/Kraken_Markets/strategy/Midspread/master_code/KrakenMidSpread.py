@@ -75,40 +75,94 @@ class KrakenMidSpread(KrakenCore):
         open_orders = self.Get_Open_Orders("buy")
 
         #Loop over the different orders in stacking
-        for displacement, volume in Volume_Stack.items():
-            #Set the displacement based on stacking
-            d = float(displacement)
-            vol_float = float(volume)
-
-            #Skew the prices based on Formulas
-            bid_price = self.Apply_Bid_Lean2_Price(self.lean, self.l, d, rpm,balance_ratio,settings)
-            
-            #Since there will be a lot of dust around the best price
-            #Use this ordering for optimal speed
-            bids = self.Remove_DustVol_From_BidOrderBook(self.dust,volume,Orderbook)
-
-            #Find next bid smaller than ours
-            bids = self.Remove_BestBids_From_OrderBook(bids, bid_price)
-
-            #if any bids, put one above
-            if bids.empty:
-                bid_price = bid_price
-            else:
-                #Need to sort the the orders correctly
-                our_best_bid = bids["price"].sort_values(ascending=False).iloc[0]
-                bid_price = float(our_best_bid) + self.min_price
-
-            #Cancel the open orders between the necessary volumes
-            self.Cancel_Open_Orders(open_orders, base_vol, vol_float)
-
-            #Now post our bid at this price
-            time_multi_factor = float(volume)/min_vol
-            self.PostBid(bid_price,volume,settings,time_multi_factor)
+        for level, (displacement, volume) in enumerate(Volume_Stack.items()):
+            with self.metrics.Stage("Bid_Level", side="buy", level=level, displacement=displacement):
+                #Set the displacement based on stacking
+                d = float(displacement)
+                vol_float = float(volume)
+
+                #Skew the prices based on Formulas
+                bid_price = self.Apply_Bid_Lean2_Price(self.lean, self.l, d, rpm,balance_ratio,settings)
+                if self.journal is not None:
+                    self.journal.Record("intent", "buy", bid_price, vol_float, level)
+
+                #Since there will be a lot of dust around the best price
+                #Use this ordering for optimal speed
+                bids = self.Remove_DustVol_From_BidOrderBook(self.dust,volume,Orderbook)
+
+                #Find next bid smaller than ours
+                bids = self.Remove_BestBids_From_OrderBook(bids, bid_price)
+
+                #if any bids, put one above
+                if bids.empty:
+                    bid_price = bid_price
+                else:
+                    #Need to sort the the orders correctly
+                    our_best_bid = bids["price"].sort_values(ascending=False).iloc[0]
+                    bid_price = float(our_best_bid) + self.min_price
+
+                #Cancel the open orders between the necessary volumes
+                self.Cancel_Open_Orders(open_orders, base_vol, vol_float)
+
+                #Now post our bid at this price
+                time_multi_factor = float(volume)/min_vol
+                with self.metrics.Stage("PostBid", side="buy", level=level):
+                    posted = self.PostBid(bid_price,volume,settings,time_multi_factor,level)
+
+                #Remember it so the requotes know when it expires
+                self.quotes[("buy", level)] = (posted, vol_float,
+                                               time.time() + settings["expiretmAdd"]*time_multi_factor)
         
+    #############################
+    #Post the shallow stack every cycle and the deep one every few
+    #############################
+    def Make_ShallowDeep_Posts(self, rpm, Orderbook, Volume_Stack, local_settings, balance_ratio, cntr):
+        """Make the bids/asks which are shallow in the tradebook and deep in the tradebook. 
+
+            Args:
+                -rpm (float) : The price of the asset from the midspead stategy
+                -Orderbook (pandas dataframe) : The book of all current trades used to predict 
+                                                the best price to buy/sell. 
+                -Volume_Stack (dictionary) : How to stack the volumes of different posts
+                -local_settings (dictionary) : A list of the local settings.
+                -balance_ratio (float) : How much do you want to buy vs sell of an asset. 
+                -cntr (int) : The cycles since the last deep posts.
+            Returns:                                                                                         
+                -Reload_counter (int) : a counter used to identify when to update the settings of the controller. 
+         """
+
+        #Reload the shallow orders first
+        #Compute Price and Post
+        if  cntr < local_settings["deep_reload_counter"]:
+            #This is how far down in stacking we want to go
+            shallow_depth = local_settings["shallow_depth"]
+        
+            #Make the shallow stack
+            shallow_volume_stack = {key: Volume_Stack[key] for key in list(Volume_Stack)[:shallow_depth]} 
+        
+            #Do shallow posting
+            self.Find_And_Post_BestAsk(rpm, Orderbook, shallow_volume_stack, local_settings,balance_ratio)
+            print()
+            self.Find_And_Post_BestBid(rpm, Orderbook, shallow_volume_stack, local_settings,balance_ratio)
+        
+            #Increase the counter for next time
+            reload_counter = cntr + 1
+        else:
+        
+            #Do Shallow + Deep Posting
+            self.Find_And_Post_BestAsk(rpm, Orderbook, Volume_Stack, local_settings,balance_ratio)
+            print()
+            self.Find_And_Post_BestBid(rpm, Orderbook, Volume_Stack, local_settings,balance_ratio)
+        
+            #Re initialise
+            reload_counter = 0                
+
+        return reload_counter
+
     #############################
     #Make Bid. 
     #############################
-    def PostBid(self,bid_price,vol2trade,settings,time_fac):
+    def PostBid(self,bid_price,vol2trade,settings,time_fac,level=-1):
 
         """
         This function posts the actual bid after checking if it's in the book
@@ -123,12 +177,16 @@ class KrakenMidSpread(KrakenCore):
         - The dictionary of settings, used to determine the expiry time
         time_fac : float
         - The multiplication factor to keep larger orders in the book
+        level : int, optional
+        - The level of the stack, for the journal
         Returns
         -------
-        Nothing, just posts the bid
+        bid_price : float or None
+        - The price posted at, None if the post failed
         """
         #If the Bid is not in the book, move it up to best bid
-        bid_price = self.Check_Bid_In_Book(bid_price)
+        with self.metrics.Stage("Check_Bid_In_Book"):
+            bid_price = self.Check_Bid_In_Book(bid_price)
         bid_price = round(bid_price,self.min_price_digit)
 
         #Decide then to start can cancel orders
@@ -139,30 +197,38 @@ class KrakenMidSpread(KrakenCore):
 
         #Post bid
         print(self.market + " bid price is " + str(bid_price) + " with volume " + vol2trade)
+        if self.journal is not None:
+            self.journal.Record("post", "buy", bid_price, float(vol2trade), level,
+                                exchange_time=starttm - settings["starttmAdd"])
         #If the post works, great, if not continue
         try:
-            order_buy = next(self.client_cycler).add_standard_order(pair=self.market,
-                                                                    type="buy",
-                                                                    ordertype="limit",
-                                                                    volume=vol2trade,
-                                                                    price=bid_price,
-                                                                    validate=False,
-                                                                    #starttm=starttm,
-                                                                    expiretm=expiretm,
-                                                                    oflags="post")
+            order_buy = self.Call_API("add_standard_order",
+                                      pair=self.market,
+                                      type="buy",
+                                      ordertype="limit",
+                                      volume=vol2trade,
+                                      price=bid_price,
+                                      validate=False,
+                                      #starttm=starttm,
+                                      expiretm=expiretm,
+                                      oflags="post")
             
             print("This is the bid order: ")
             print(order_buy)
+            self.Journal_Ack(order_buy, "buy", level, bid_price, vol2trade)
 
         except Exception:
             traceback.print_exc()
-            return
+            self.Journal_Reject("buy", level, bid_price, vol2trade)
+            return None
+
+        return bid_price
             
         
     #############################
     #Make Ask 
     #############################
-    def PostAsk(self,ask_price, vol2trade,settings,time_fac):
+    def PostAsk(self,ask_price, vol2trade,settings,time_fac,level=-1):
         """
         This function posts the actual ask after checking if it's in the book
         
@@ -176,14 +242,18 @@ class KrakenMidSpread(KrakenCore):
         - The dictionary of settings, used to determine the expiry time
         time_fac : float
         - The multiplication factor to keep larger orders in the book
+        level : int, optional
+        - The level of the stack, for the journal
         Returns
         -------
-        Nothing, just posts the ask
+        ask_price : float or None
+        - The price posted at, None if the post failed
         """
         
         #Make sure we are in the right side of the book
         #If not move it to best ask + min_price
-        ask_price = self.Check_Ask_In_Book(ask_price)        
+        with self.metrics.Stage("Check_Ask_In_Book"):
+            ask_price = self.Check_Ask_In_Book(ask_price)
         ask_price = round(ask_price,self.min_price_digit)
 
         #Decide then to start can cancel orders
@@ -194,22 +264,30 @@ class KrakenMidSpread(KrakenCore):
 
         #Place the Order
         print(self.market + " ask price is " + str(ask_price) + " with volume " + vol2trade )
+        if self.journal is not None:
+            self.journal.Record("post", "sell", ask_price, float(vol2trade), level,
+                                exchange_time=starttm - settings["starttmAdd"])
         #If post doesn't work then start return
         try:
-            order_sell = next(self.client_cycler).add_standard_order(pair=self.market,
-                                                                     type="sell",
-                                                                     ordertype="limit",
-                                                                     volume=vol2trade,
-                                                                     price=ask_price,
-                                                                     validate=False,
-                                                                     #starttm=starttm,
-                                                                     expiretm=expiretm,
-                                                                     oflags="post")
+            order_sell = self.Call_API("add_standard_order",
+                                       pair=self.market,
+                                       type="sell",
+                                       ordertype="limit",
+                                       volume=vol2trade,
+                                       price=ask_price,
+                                       validate=False,
+                                       #starttm=starttm,
+                                       expiretm=expiretm,
+                                       oflags="post")
             print("This is the ask order: ")
             print(order_sell)
+            self.Journal_Ack(order_sell, "sell", level, ask_price, vol2trade)
         except Exception:
             traceback.print_exc()
-            return
+            self.Journal_Reject("sell", level, ask_price, vol2trade)
+            return None
+
+        return ask_price
 
 
     #############################
@@ -249,35 +327,43 @@ class KrakenMidSpread(KrakenCore):
         open_orders = self.Get_Open_Orders("sell")
         
         #Loop over the different orders in stacking
-        for displacement, volume in Volume_Stack.items():
-            d = float(displacement)
-            vol_float = float(volume)
+        for level, (displacement, volume) in enumerate(Volume_Stack.items()):
+            with self.metrics.Stage("Ask_Level", side="sell", level=level, displacement=displacement):
+                d = float(displacement)
+                vol_float = float(volume)
 
-            #Skew the prices based on Formulas
-            ask_price = self.Apply_Ask_Lean2_Price(self.lean,self.l,d,rpm,balance_ratio,settings)
-            
-            #Since there will be a lot of dust around the best price
-            #Use this ordering for optimal speed
-            asks = self.Remove_DustVol_From_AskOrderBook(self.dust,volume,Orderbook)
+                #Skew the prices based on Formulas
+                ask_price = self.Apply_Ask_Lean2_Price(self.lean,self.l,d,rpm,balance_ratio,settings)
+                if self.journal is not None:
+                    self.journal.Record("intent", "sell", ask_price, vol_float, level)
 
-            #Find next bid smaller than ours
-            asks = self.Remove_BestAsks_From_OrderBook(asks, ask_price)
+                #Since there will be a lot of dust around the best price
+                #Use this ordering for optimal speed
+                asks = self.Remove_DustVol_From_AskOrderBook(self.dust,volume,Orderbook)
 
-            #if any bids, put one above
-            if asks.empty:
-                ask_price = ask_price
-            else:
-                #Need to sort the orders correctly
-                our_best_ask = asks["price"].sort_values().iloc[0]
-                ask_price = float(our_best_ask) - self.min_price
+                #Find next bid smaller than ours
+                asks = self.Remove_BestAsks_From_OrderBook(asks, ask_price)
 
-                
-            #Cancel the open orders between the necessary volumes
-            self.Cancel_Open_Orders(open_orders, base_vol, vol_float)
-                        
-            #Now post our bid at this price
-            time_multi_factor = float(volume)/min_vol
-            self.PostAsk(ask_price,volume,settings,time_multi_factor)
+                #if any bids, put one above
+                if asks.empty:
+                    ask_price = ask_price
+                else:
+                    #Need to sort the orders correctly
+                    our_best_ask = asks["price"].sort_values().iloc[0]
+                    ask_price = float(our_best_ask) - self.min_price
+
+
+                #Cancel the open orders between the necessary volumes
+                self.Cancel_Open_Orders(open_orders, base_vol, vol_float)
+
+                #Now post our bid at this price
+                time_multi_factor = float(volume)/min_vol
+                with self.metrics.Stage("PostAsk", side="sell", level=level):
+                    posted = self.PostAsk(ask_price,volume,settings,time_multi_factor,level)
+
+                #Remember it so the requotes know when it expires
+                self.quotes[("sell", level)] = (posted, vol_float,
+                                                time.time() + settings["expiretmAdd"]*time_multi_factor)
 
 
 
@@ -302,15 +388,22 @@ class KrakenMidSpread(KrakenCore):
         try:
             
             #Get open orders to know what to cancel to avoid accidental stacking
-            open_orders = next(self.client_cycler).get_open_orders()
-            
-            #Since each key is restricted to one market pair
-            #We only need to restrict to ordertype and not pair/limit
+            with self.metrics.Stage("Get_Open_Orders"):
+                open_orders = self.Call_API("get_open_orders")
+
+            #The keys are shared by the bots of every market, so only
+            #keep the orders of this market before restricting to ordertype
+            open_orders = self.Market_Orders(open_orders)
+
+            #Journal the fills since the last look
+            if self.journal is not None:
+                self.journal.Track_Open_Orders(open_orders)
+
             open_orders = open_orders.loc[ open_orders["descr_type"] == ordertype ] 
             
-            #Convert the volumes to numbers
+            #Convert the volumes to numbers, the whole column at once
             cols = 'vol'
-            open_orders[cols] = open_orders[cols].apply(pd.to_numeric, errors='coerce')
+            open_orders[cols] = pd.to_numeric(open_orders[cols], errors='coerce')
             
         except Exception:
             print("Was not able to get asks open orders")
@@ -353,7 +446,10 @@ class KrakenMidSpread(KrakenCore):
             txnids = orders_to_close.index
             for txn in txnids:
                 try:
-                    cancel_order = next(self.client_cycler).cancel_open_order(txn)
+                    with self.metrics.Stage("cancel_open_order"):
+                        cancel_order = self.Call_API("cancel_open_order", txn)
+                    if self.journal is not None:
+                        self.journal.Cancelled(txn, self.last_call.key, self.last_call.rtt)
                 except Exception:
                     traceback.print_exc()
                 
@@ -365,3 +461,84 @@ class KrakenMidSpread(KrakenCore):
             base_vol = 0.0
 
         return base_vol
+
+    #############################
+    #Cancel everything we posted
+    #############################
+    def Cancel_All_Orders(self):
+        """
+        Cancel all our open orders in this market, eg., before backing
+        off after an error so nothing is left resting at an old price
+
+        Returns
+        -------
+        cancelled : int
+        - The number of orders cancelled
+        """
+        open_orders = self.Market_Orders(self.Call_API("get_open_orders"))
+
+        cancelled = 0
+        for txn in open_orders.index:
+            try:
+                with self.metrics.Stage("cancel_open_order"):
+                    self.Call_API("cancel_open_order", txn)
+                cancelled += 1
+                if self.journal is not None:
+                    self.journal.Cancelled(txn, self.last_call.key, self.last_call.rtt)
+            except Exception:
+                traceback.print_exc()
+
+        #The next cycle posts everything again
+        self.quotes = {}
+        print("Cancelled " + str(cancelled) + " of our open orders")
+        return cancelled
+
+    #############################
+    #The orders of this market
+    #############################
+    def Market_Orders(self, open_orders):
+        """
+        Only the open orders of this market, as the keys may be shared
+        with the bots of other markets
+
+        Parameters
+        ----------
+        open_orders : pandas dataframe
+        - The pykrakenapi get_open_orders answer
+
+        Returns
+        -------
+        open_orders : pandas dataframe
+        """
+        if not "descr_pair" in open_orders.columns:
+            return open_orders
+
+        #Kraken names the pair of an order by its altname
+        pairs = [self.market]
+        if self.assets is not None:
+            pairs.append(self.assets.Altname(self.market))
+        return open_orders.loc[open_orders["descr_pair"].isin(pairs)]
+
+    #############################
+    #Journal the answer to a post
+    #############################
+    def Journal_Ack(self, order, side, level, price, volume):
+        """
+        Journal a post Kraken took, with its txid, key and round trip
+        """
+        if self.journal is None:
+            return
+        txids = order.get("txid", [""]) if isinstance(order, dict) else [""]
+        self.journal.Acked(txids[0], side, level, price, volume,
+                           getattr(self.last_call, "key", -1), getattr(self.last_call, "rtt", float("nan")))
+
+    #############################
+    def Journal_Reject(self, side, level, price, volume):
+        """
+        Journal a post Kraken refused or which never got an answer
+        """
+        if self.journal is None:
+            return
+        self.journal.Record("reject", side, price, float(volume), level,
+                            key=getattr(self.last_call, "key", -1),
+                            rtt=getattr(self.last_call, "rtt", float("nan")))
@@ -37,103 +37,139 @@ import BotFile
 sys.path.append("../../../master_code/")
 #from filename import class
 from KrakenMidSpread import KrakenMidSpread
+from KrakenRequoteScheduler import RequoteScheduler
+from KrakenCheckpoint import Make_Checkpoint
+from KrakenSupervisor import KrakenSupervisor
+from RollingStats import RollingPriceWindow
 import Utils as utl
 
 #################################### Main program #######################
-def main(Volume_Stack,midspread_check):
+def main(Volume_Stack,midspread_check,requote=None,checkpoint=None,temp_reload_counter=0,supervisor=None):
     """Run the code to post bids and asks with a midspread strategy.        
 
         Args:                                                                                            
             -Volume_Stack (dictionary) : How to stack the volumes of different posts
-            -midspread_check (float) : The mean midspread price to avoid manipulations 
-                                       when there are large changes in price
+            -midspread_check (RollingPriceWindow) : The midspread prices of the last day to avoid
+                                       manipulations when there are large changes in price
+            -requote (RequoteScheduler, optional) : Only post when the market moved, instead of every cycle
+            -checkpoint (KrakenCheckpoint, optional) : Where to keep the state for a warm restart
+            -temp_reload_counter (int, optional) : The cycles since the last deep posts
+            -supervisor (KrakenSupervisor, optional) : Decides how to recover from an error
         Returns:                                                                                         
             -Nothing returned.                                                                                            
      """
 
     #Initialise variables outside loop
-    temp_reload_counter = 0
+    book_version = 0
+    if supervisor is None:
+        supervisor = KrakenSupervisor(local_settings)
+        controller.metrics.Add_Gauges(supervisor.Get_Gauges)
     
-    try:
-        while True: 
-            #
-            #It's all about speed. Get best price last
-            #
-            #Reload the Variables
-            Volume_Stack = controller.Reload_Params(local_settings["reload_time"], Volume_Stack,local_settings,args.sftppass)
-
-            #Get Orderbook first so we can stack orders.
-            #Getting order right is less important than price.
-            #So get price last
-            Orderbook = controller.Get_OrderBook(depth=controller.odepth,
-                                                 mrkt=controller.market)
-
-            #Get the midspread price
-            rpm = controller.Get_MidSpread_Price(controller.market)
-
-            #Check there has been no large Price changes over the last 24hrs
-            midspread_check = controller.Check_No_Large_Price_Change(rpm, local_settings["price_change"], midspread_check)
-
-            #Get Account Balance
-            balance_ratio = controller.Get_Acct_Balances(rpm, local_settings)
-
-            #Make the posts
-            temp_reload_counter = Make_ShallowDeep_Posts(rpm, Orderbook, Volume_Stack, local_settings, balance_ratio, temp_reload_counter)
+    #Errors are recovered from in place, so the loop never grows the stack
+    while True: 
+        try:
+            #If streaming, requote as soon as the book changes
+            if controller.feed is not None:
+                book_version = controller.feed.Wait_For_Book_Change(book_version, local_settings.get("stream_wait", 1.0))
+            #Else don't poll the REST book as fast as it answers
+            elif requote is not None:
+                time.sleep(requote.poll)
+
+            #One cycle of reading the market and posting
+            with controller.metrics.Stage("cycle"):
+                Volume_Stack, midspread_check, temp_reload_counter = Run_Quote_Cycle(
+                    controller, local_settings, args.sftppass, Volume_Stack, midspread_check, temp_reload_counter,
+                    requote)
+            supervisor.Succeeded()
+
+            #Keep the price window after deep posts so a restart doesn't reset it
+            if temp_reload_counter == 0 and "price_window_file" in local_settings.keys():
+                midspread_check.Save_State(local_settings["price_window_file"])
+
+            #Keep everything a restart needs every checkpoint_interval seconds
+            if checkpoint is not None:
+                checkpoint.Save_If_Due(controller, Volume_Stack, midspread_check, temp_reload_counter, requote)
+
+            #Say where the time is going every so often
+            controller.metrics.Print_Summary(local_settings.get("metrics_summary", 60))
                 
-    except Exception:
-        traceback.print_exc()
-        print("Kraken Bot in"+str(os.getcwd())+" has broken.")
-        print("########################################")
-        print("Restarting After Error")
-        print("########################################")
-        main(Volume_Stack,midspread_check)
+        except (Exception, SystemExit) as e:
+            traceback.print_exc()
+            print("Kraken Bot in"+str(os.getcwd())+" has broken.")
+            print("########################################")
+            print("Restarting After Error")
+            print("########################################")
+            supervisor.Recover(e, controller)
+
+            #Post the whole stack again after an error, the next cycle is a deep one
+            temp_reload_counter = local_settings["deep_reload_counter"]
+
 
-        
 #############################
-def Make_ShallowDeep_Posts(rpm, Orderbook, Volume_Stack, local_settings,balance_ratio, cntr):
-    """Make the bids/asks which are shallow in the tradebook and deep in the tradebook. 
+def Run_Quote_Cycle(controller, local_settings, sftppass, Volume_Stack, midspread_check, temp_reload_counter,
+                    requote=None):
+    """One cycle of the bot: read the market, check it and post the bids/asks.
+       Every stage is timed into the controller metrics.
 
         Args:
-            -rpm (float) : The price of the asset from the midspead stategy
-            -Orderbook (pandas dataframe) : The book of all current trades used to predict 
-                                            the best price to buy/sell. 
-            -Volume_Stack (dictionary) : How to stack the volumes of different posts
+            -controller (KrakenMidSpread) : The connected bot
             -local_settings (dictionary) : A list of the local settings.
-            -balance_ratio (float) : How much do you want to buy vs sell of an asset. 
-            -cntr (class)  : The KrakenCoreMidspread class which connects to the clients servers.
-        Returns:                                                                                         
-            -Reload_counter (int) : a counter used to identify when to update the settings of the controller. 
+            -sftppass (str) : The password for the sftpserver
+            -Volume_Stack (dictionary) : How to stack the volumes of different posts
+            -midspread_check (RollingPriceWindow) : The midspread prices of the last day
+            -temp_reload_counter (int) : The cycles since the last deep posts
+            -requote (RequoteScheduler, optional) : Decides if and how deep to post. Without it
+                                       the bot posts every cycle and the deep stack
+                                       every deep_reload_counter cycles
+        Returns:
+            -(Volume_Stack, midspread_check, temp_reload_counter) (tuple) : The updated values
      """
+    metrics = controller.metrics
+
+    #
+    #It's all about speed. Get best price last
+    #
+    #Reload the Variables
+    with metrics.Stage("Reload_Params"):
+        Volume_Stack = controller.Reload_Params(local_settings["reload_time"], Volume_Stack,local_settings,sftppass)
+
+    #Get Orderbook first so we can stack orders.
+    #Getting order right is less important than price.
+    #So get price last
+    with metrics.Stage("Get_OrderBook"):
+        Orderbook = controller.Get_OrderBook(depth=controller.odepth,
+                                             mrkt=controller.market)
+
+    #Get the midspread price
+    with metrics.Stage("Get_MidSpread_Price"):
+        rpm = controller.Get_MidSpread_Price(controller.market)
+
+    #Check there has been no large Price changes over the last 24hrs
+    with metrics.Stage("Check_No_Large_Price_Change"):
+        midspread_check = controller.Check_No_Large_Price_Change(rpm, local_settings["price_change"], midspread_check)
+
+    #Only post if something happened since the last posts
+    if requote is not None:
+        with metrics.Stage("Requote_Due"):
+            deep = requote.Due(controller, rpm, Orderbook)
+        if deep is None:
+            return Volume_Stack, midspread_check, temp_reload_counter + 1
+        temp_reload_counter = local_settings["deep_reload_counter"] if deep else 0
+
+    #Get Account Balance
+    with metrics.Stage("Get_Acct_Balances"):
+        balance_ratio = controller.Get_Acct_Balances(rpm, local_settings)
+
+    #Make the posts
+    with metrics.Stage("Make_ShallowDeep_Posts"):
+        temp_reload_counter = controller.Make_ShallowDeep_Posts(rpm, Orderbook, Volume_Stack, local_settings, balance_ratio, temp_reload_counter)
+
+    if requote is not None:
+        requote.Requoted(rpm)
+
+    return Volume_Stack, midspread_check, temp_reload_counter
 
-    #Reload the shallow orders first
-    #Compute Price and Post
-    if  cntr < local_settings["deep_reload_counter"]:
-        #This is how far down in stacking we want to go
-        shallow_depth = local_settings["shallow_depth"]
-        
-        #Make the shallow stack
-        shallow_volume_stack = {key: Volume_Stack[key] for key in list(Volume_Stack)[:shallow_depth]} 
-        
-        #Do shallow posting
-        controller.Find_And_Post_BestAsk(rpm, Orderbook, shallow_volume_stack, local_settings,balance_ratio)
-        print()
-        controller.Find_And_Post_BestBid(rpm, Orderbook, shallow_volume_stack, local_settings,balance_ratio)
         
-        #Increase the counter for next time
-        reload_counter = cntr + 1
-    else:
-        
-        #Do Shallow + Deep Posting
-        controller.Find_And_Post_BestAsk(rpm, Orderbook, Volume_Stack, local_settings,balance_ratio)
-        print()
-        controller.Find_And_Post_BestBid(rpm, Orderbook, Volume_Stack, local_settings,balance_ratio)
-        
-        #Re initialise
-        reload_counter = 0                
-
-    return reload_counter
-
-
 #############################
 if __name__ == '__main__':
     """Args: Specified Below
@@ -153,23 +189,50 @@ if __name__ == '__main__':
     print(args.settings)
     local_settings = utl.Read_JSON_File(args.settings)
 
+    #Restart warm from the last checkpoint if there is a recent one
+    checkpoint = Make_Checkpoint(local_settings)
+    state = checkpoint.Load() if checkpoint is not None else None
+
     #Initialise the Kraken
     controller = KrakenMidSpread(key=args.key,
                                  secret=args.secret,
                                  sftppassword=args.sftppass,
-                                 settings=local_settings)
+                                 settings=local_settings,
+                                 params=None if state is None else state["params"])
 
-    #Compute the initial volume stacking
-    Volume_Stack = controller.Setup_Volume_Stacking(local_settings, controller)
+    #Requote on events rather than every cycle
+    requote = None
+    if "requote_move" in local_settings.keys():
+        requote = RequoteScheduler(local_settings)
+        controller.metrics.Add_Gauges(requote.Get_Gauges)
 
     #Initialise stuff for checking not sharp changes in midspread
-    rpm = controller.Get_MidSpread_Price(controller.market)
-    midspread_check = pd.DataFrame({"unixtime" : [ int(time.time()) ], "price" : [rpm] })
+    midspread_check = RollingPriceWindow()
+    temp_reload_counter = 0
+    if state is not None:
+        Volume_Stack, temp_reload_counter = checkpoint.Restore(controller, state, midspread_check, requote)
+    else:
+        #Compute the initial volume stacking
+        Volume_Stack = controller.Setup_Volume_Stacking(local_settings, controller)
+
+        #Carry on from the saved window of the last run if there is one
+        if "price_window_file" in local_settings.keys():
+            midspread_check.Load_State(local_settings["price_window_file"])
+        rpm = controller.Get_MidSpread_Price(controller.market)
+        midspread_check.Add(rpm)
+
+    #Read the new parameters off the quote loop
+    if local_settings.get("param_refresh", True):
+        controller.Start_Param_Refresh(local_settings, args.sftppass, Volume_Stack)
+
+    #Quote at once and check the checkpoint against Kraken meanwhile
+    if state is not None:
+        checkpoint.Start_Validate(controller)
     
     #If we have the input params, run main. Otherwise exit
     try:
         #Call main after importing input params. 
-        main(Volume_Stack,midspread_check)
+        main(Volume_Stack,midspread_check,requote,checkpoint,temp_reload_counter)
     except: 
         print("Main Failed")
         raise